@@ -1,15 +1,75 @@
+from __future__ import annotations
+
+import io
 import os
+import re
 import sys
+import tempfile
+import threading
+import numpy as np
 import requests
+from concurrent.futures import Future
+from requests.adapters import HTTPAdapter
 import pandas as pd
-from datetime import datetime, timedelta, timezone
-from dateutil.parser import isoparse
-from flask import Flask, render_template, request, url_for
+# JSON decoder preference: orjson > pandas' bundled ujson > stdlib json
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:  # orjson is optional
+    try:
+        from pandas.io.json import ujson_loads
+
+        def _json_loads(content: bytes):
+            return ujson_loads(content.decode("utf-8"))
+    except ImportError:  # stdlib json also accepts bytes
+        import json
+        _json_loads = json.loads
+from datetime import datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+from flask import Flask, render_template, request, send_file, url_for
+import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 
 API_URL = "https://www.alphavantage.co/query"
+# (connect, read) seconds: an unreachable API fails fast instead of holding a
+# request thread for the full read timeout
+REQUEST_TIMEOUT = (5, 30)
+
+# Pooled keep-alive connections so repeat requests skip the TCP/TLS handshake
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=32))
+
+# In-flight fetches keyed by (symbol, interval, full); concurrent callers for
+# the same key wait on the first caller's Future instead of refetching
+_IN_FLIGHT: dict = {}
+_IN_FLIGHT_LOCK = threading.Lock()
+
+# Parsed frames are cached on disk; historical bars never change, so only the
+# most recent ones need refreshing once the TTL has passed.
+CACHE_DIR = Path(".cache")
+INTRADAY_CACHE_TTL = timedelta(seconds=60)
+DAILY_CACHE_TTL = timedelta(hours=12)
+COMPACT_BARS = 100  # number of bars returned by outputsize=compact
+# Bumped when the cached frame layout changes so stale files are never read.
+# v2: prices float64 / volume int64 (v1 frames had truncated float32 prices)
+CACHE_VERSION = 2
+# Fixed timestamp formats of the TIME_SERIES_* endpoints
+_TS_FORMATS = {"daily": "%Y-%m-%d", "intraday": "%Y-%m-%d %H:%M:%S"}
+
+# (ETag, Last-Modified) of the response behind each cached frame, used to make
+# refreshes conditional so an unchanged series costs a 304 instead of a download
+_VALIDATORS: dict = {}
 
 app = Flask(__name__)
 
+# Web plots are drawn on one reusable Figure. Using Figure directly renders
+# through Agg without touching pyplot, so the CLI keeps its interactive backend.
+PLOT_FIG = Figure()
+PLOT_AX = PLOT_FIG.subplots()
+PLOT_LOCK = threading.Lock()
+
+@lru_cache(maxsize=128)
 def parse_period(s: str) -> timedelta:
     """
     Accepts period strings like: 30m, 90m, 2h, 6h, 1d, 5d, 1w, 2w
@@ -27,6 +87,7 @@ def parse_period(s: str) -> timedelta:
         return timedelta(days=int(s[:-1]) * 365) # Approximation
     raise ValueError(f"Unsupported period: {s}")
 
+@lru_cache(maxsize=128)
 def choose_interval(period: timedelta) -> str:
     """
     Pick Alpha Vantage intraday interval based on lookback.
@@ -44,100 +105,201 @@ def choose_interval(period: timedelta) -> str:
         return "60min"
     return "daily"
 
-def fetch_intraday(symbol: str, api_key: str, interval: str, full: bool) -> pd.DataFrame:
+def _cache_path(symbol: str, interval: str, full: bool) -> Path:
     """
-    Calls Alpha Vantage TIME_SERIES_INTRADAY and returns a DataFrame with UTC timestamps.
+    Location of the cached frame for a (symbol, interval, outputsize) query.
     """
-    params = {
-        "function": "TIME_SERIES_INTRADAY",
-        "symbol": symbol,
-        "interval": interval,
-        "apikey": api_key,
-        "datatype": "json",
-        "outputsize": "full" if full else "compact",
-    }
-    r = requests.get(API_URL, params=params, timeout=30)
+    size = "full" if full else "compact"
+    # symbol comes from the request; keep it to one safe path component
+    name = re.sub(r"[^A-Z0-9._-]", "_", symbol.upper())
+    return CACHE_DIR / f"{name}_{interval}_{size}_v{CACHE_VERSION}.feather"
+
+def _read_cache(path: Path, ttl: timedelta):
+    """
+    Returns (df, fresh) for a cached frame, or (None, False) if there is none.
+    """
+    try:
+        mtime = path.stat().st_mtime
+        df = pd.read_feather(path)
+    except (OSError, ValueError):  # missing or partially written file
+        return None, False
+    fresh = datetime.now() - datetime.fromtimestamp(mtime) <= ttl
+    return df, fresh
+
+def _compact_covers(cached: pd.DataFrame, bar: timedelta) -> bool:
+    """
+    True if outputsize=compact still reaches back to the last cached bar.
+    Wall-clock gaps are at least as long as trading-time gaps, so this is conservative.
+    """
+    return datetime.now() - cached["time"].max() < COMPACT_BARS * bar
+
+def _merge_cache(cached: pd.DataFrame, df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Appends freshly fetched bars to the cached history, preferring the fresh rows.
+    """
+    older = cached[cached["time"] < df["time"].min()]
+    return pd.concat([older, df], ignore_index=True)
+
+def _write_cache(df: pd.DataFrame, path: Path) -> None:
+    """
+    Saves a frame as lz4-compressed Feather.
+    """
+    CACHE_DIR.mkdir(exist_ok=True)
+    # Write to a temp file and rename so concurrent readers never see a partial frame
+    fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    os.close(fd)
+    try:
+        df.reset_index(drop=True).to_feather(tmp, compression="lz4")
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):  # only left behind if the write or rename failed
+            os.remove(tmp)
+
+def _get(params: dict, validators: tuple | None = None) -> requests.Response:
+    """
+    GETs an Alpha Vantage query. validators is the (ETag, Last-Modified) pair of
+    the response behind a cached frame; if given, the request is conditional and
+    may come back 304 Not Modified with no body.
+    """
+    headers = {}
+    if validators:
+        etag, last_modified = validators
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+    r = SESSION.get(API_URL, params=params, headers=headers, timeout=REQUEST_TIMEOUT)
     r.raise_for_status()
-    data = r.json()
+    return r
 
-    # Handle API throttle / error messages
+def _check_errors(data: dict) -> None:
+    """
+    Raises RuntimeError for Alpha Vantage throttle / error payloads.
+    """
     if "Note" in data:
         raise RuntimeError(f"Alpha Vantage rate limit: {data['Note']}")
     if "Information" in data:
         raise RuntimeError(f"Alpha Vantage info: {data['Information']}")
     if "Error Message" in data:
         raise RuntimeError(f"Alpha Vantage error: {data['Error Message']}")
-    key = next((k for k in data.keys() if k.startswith("Time Series")), None)
-    if not key:
-        raise RuntimeError(f"Unexpected response: {list(data.keys())}")
 
-    ts = data[key]
-    # ts is dict: { "2025-10-07 15:59:00": { "1. open": "...", ... } }
-    records = []
-    for ts_str, ohlc in ts.items():
-        # Alpha Vantage timestamps are in the market time zone (usually US/Eastern)
-        # Parse naïvely and treat as local timestamp; convert to UTC for consistency
-        dt_local = isoparse(ts_str)  # naive or offset-aware
-        if dt_local.tzinfo is None:
-            # Assume timestamps are US/Eastern if naive; convert to UTC by attaching ET and converting.
-            # To avoid tz database dependency, treat as naive and keep as naive; users can interpret.
-            # Simpler: keep as naive and document. We'll store as naive; filtering will be by naive now().
-            dt = dt_local
-        else:
-            dt = dt_local.astimezone(timezone.utc).replace(tzinfo=None)
-        records.append({
-            "time": dt,
-            "open": float(ohlc["1. open"]),
-            "high": float(ohlc["2. high"]),
-            "low":  float(ohlc["3. low"]),
-            "close":float(ohlc["4. close"]),
-            "volume": int(float(ohlc["5. volume"])),
-        })
-    df = pd.DataFrame.from_records(records).sort_values("time")
-    return df
+def _decode_json(content: bytes) -> dict:
+    """
+    Decodes an Alpha Vantage response body, raising on API errors.
+    """
+    data = _json_loads(content)
+    _check_errors(data)
+    return data
 
-def fetch_daily(symbol: str, api_key: str, full: bool) -> pd.DataFrame:
+def _fetch(function: str, fmt: str, symbol: str, api_key: str,
+           interval: str | None, full: bool) -> pd.DataFrame:
     """
-    Calls Alpha Vantage TIME_SERIES_DAILY and returns a DataFrame.
+    Calls an Alpha Vantage TIME_SERIES_* endpoint and returns a DataFrame sorted by time.
+    fmt is the endpoint's fixed timestamp format; interval is only used for intraday data.
     """
+    daily = function == "TIME_SERIES_DAILY"
+    if not daily and not interval:
+        raise ValueError(f"{function} requires an interval")
+    path = _cache_path(symbol, "daily" if daily else interval, full)
+    cached, fresh = _read_cache(path, DAILY_CACHE_TTL if daily else INTRADAY_CACHE_TTL)
+    if fresh:
+        return cached
+    # A stale full history only needs the bars since its last row
+    bar = timedelta(days=1) if daily else timedelta(minutes=int(interval[:-3]))  # "5min" -> 5 minutes
+    incremental = full and cached is not None and _compact_covers(cached, bar)
+
     params = {
-        "function": "TIME_SERIES_DAILY",
+        "function": function,
         "symbol": symbol,
         "apikey": api_key,
         "datatype": "json",
-        "outputsize": "full" if full else "compact",
+        "outputsize": "full" if full and not incremental else "compact",
     }
-    r = requests.get(API_URL, params=params, timeout=30)
-    r.raise_for_status()
-    data = r.json()
-
-    # Handle API throttle / error messages
-    if "Note" in data:
-        raise RuntimeError(f"Alpha Vantage rate limit: {data['Note']}")
-    if "Information" in data:
-        raise RuntimeError(f"Alpha Vantage info: {data['Information']}")
-    if "Error Message" in data:
-        raise RuntimeError(f"Alpha Vantage error: {data['Error Message']}")
+    if not daily:
+        params["interval"] = interval
+    r = _get(params, _VALIDATORS.get(path) if cached is not None else None)
+    if r.status_code == 304:
+        # Not modified since the cached frame was written; restart its TTL
+        path.touch()
+        return cached
+    data = _decode_json(r.content)
     key = next((k for k in data.keys() if k.startswith("Time Series")), None)
     if not key:
         raise RuntimeError(f"Unexpected response: {list(data.keys())}")
 
     ts = data[key]
-    # ts is dict: { "2025-10-07": { "1. open": "...", ... } }
-    records = []
-    for ts_str, ohlc in ts.items():
-        dt = isoparse(ts_str)
-        records.append({
-            "time": dt,
-            "open": float(ohlc["1. open"]),
-            "high": float(ohlc["2. high"]),
-            "low":  float(ohlc["3. low"]),
-            "close":float(ohlc["4. close"]),
-            "volume": int(float(ohlc["5. volume"])),
-        })
-    df = pd.DataFrame.from_records(records).sort_values("time")
+    # ts is dict: { "2025-10-07 15:59:00": { "1. open": "...", ... } }
+    # Alpha Vantage timestamps are in the market time zone (usually US/Eastern).
+    # We keep them naive; filtering is done against a naive now().
+    # Each column is filled by np.fromiter in one pass over the row dicts with a
+    # known count, parsing the strings straight into the target dtype instead of
+    # going through an object-dtype frame and astype.
+    # Prices stay float64 (float32 loses the 4th decimal above ~1024) and
+    # volumes int64 (some exceed int32).
+    rows = list(ts.values())
+    n = len(rows)
+    df = pd.DataFrame({
+        "time": pd.to_datetime(list(ts), format=fmt),
+        "open": np.fromiter((v["1. open"] for v in rows), "float64", n),
+        "high": np.fromiter((v["2. high"] for v in rows), "float64", n),
+        "low": np.fromiter((v["3. low"] for v in rows), "float64", n),
+        "close": np.fromiter((v["4. close"] for v in rows), "float64", n),
+        "volume": np.fromiter((v["5. volume"] for v in rows), "float64", n).astype("int64"),
+    })
+    # Alpha Vantage returns bars newest-first, so a reverse is enough to sort them;
+    # the monotonic check is O(N) and only falls back to a sort if that ever changes
+    df = df.iloc[::-1].reset_index(drop=True)
+    if not df["time"].is_monotonic_increasing:
+        df = df.sort_values("time", ignore_index=True)
+    if incremental:
+        df = _merge_cache(cached, df)
+    _write_cache(df, path)
+    _VALIDATORS[path] = (r.headers.get("ETag"), r.headers.get("Last-Modified"))
     return df
 
+def fetch_intraday(symbol: str, api_key: str, interval: str, full: bool) -> pd.DataFrame:
+    """
+    Calls Alpha Vantage TIME_SERIES_INTRADAY and returns a DataFrame.
+    """
+    return _fetch("TIME_SERIES_INTRADAY", _TS_FORMATS["intraday"], symbol, api_key, interval, full)
+
+def fetch_daily(symbol: str, api_key: str, full: bool) -> pd.DataFrame:
+    """
+    Calls Alpha Vantage TIME_SERIES_DAILY and returns a DataFrame.
+    """
+    return _fetch("TIME_SERIES_DAILY", _TS_FORMATS["daily"], symbol, api_key, None, full)
+
+def _coalesced(key: tuple, fn, *args, **kwargs):
+    """
+    Runs fn(*args, **kwargs) once per key at a time; concurrent callers share the result.
+    """
+    with _IN_FLIGHT_LOCK:
+        fut = _IN_FLIGHT.get(key)
+        owner = fut is None
+        if owner:
+            fut = _IN_FLIGHT[key] = Future()
+    if owner:
+        try:
+            fut.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            fut.set_exception(e)
+        finally:
+            with _IN_FLIGHT_LOCK:
+                del _IN_FLIGHT[key]
+    return fut.result()
+
+def _plot_close(ax, df_window: pd.DataFrame, symbol: str, interval: str) -> None:
+    """
+    Draws the close price over the window onto ax, replacing whatever was there.
+    """
+    ax.clear()
+    ax.plot(df_window["time"], df_window["close"])
+    ax.set_title(f"{symbol} close ({interval})")
+    ax.set_xlabel("Time")
+    ax.set_ylabel("Close")
+    for label in ax.get_xticklabels():
+        label.set(rotation=30, ha="right")
+
 def get_stock_data(symbol, period_str):
 
     api_key = os.getenv("ALPHAVANTAGE_API_KEY")
@@ -158,21 +320,32 @@ def get_stock_data(symbol, period_str):
 
 
 
+    key = (symbol.upper(), interval, use_full_output)
+
     if interval == "daily":
 
-        df = fetch_daily(symbol, api_key, full=use_full_output)
+        df = _coalesced(key, fetch_daily, symbol, api_key, full=use_full_output)
 
     else:
 
-        df = fetch_intraday(symbol, api_key, interval=interval, full=use_full_output)
+        df = _coalesced(key, fetch_intraday, symbol, api_key, interval=interval, full=use_full_output)
 
 
 
     now_local = datetime.now()
 
-    cutoff = now_local - lookback
+    # Compare as datetime64[ns] on both sides so numpy searches the raw int64
+    # values instead of coercing the cutoff to a Timestamp
+
+    cutoff = np.datetime64(now_local - lookback, "ns")
+
+    times = df["time"].values.astype("datetime64[ns]", copy=False)
 
-    df_window = df[df["time"] >= cutoff].copy()
+    # Rows are sorted by time, so binary-search the cutoff instead of masking every row
+
+    i = np.searchsorted(times, cutoff)
+
+    df_window = df.iloc[i:]
 
 
 
@@ -202,7 +375,7 @@ def stockdata():
 
         df_window, interval = get_stock_data(symbol, period_str)
 
-    except (ValueError, RuntimeError) as e:
+    except (ValueError, RuntimeError, requests.RequestException) as e:
 
         return render_template('index.html', error=str(e))
 
@@ -214,39 +387,65 @@ def stockdata():
 
 
 
-    # Generate plot
+    plot_url = url_for('plot', symbol=symbol, period=period_str)
 
-    import matplotlib.pyplot as plt
 
-    plt.figure()
 
-    plt.plot(df_window["time"], df_window["close"])
+    # Rows are rendered by a Jinja loop, which is much faster than DataFrame.to_html
 
-    plt.title(f"{symbol} close ({interval})")
+    time_format = _TS_FORMATS["daily" if interval == "daily" else "intraday"]
 
-    plt.xlabel("Time")
+    return render_template('index.html', 
 
-    plt.ylabel("Close")
+                           plot_url=plot_url, 
 
-    plt.xticks(rotation=30, ha="right")
+                           rows=df_window.itertuples(index=False, name=None),
 
-    plt.tight_layout()
+                           time_format=time_format)
 
-    
 
-    plot_path = os.path.join('static', 'stock_plot.png')
 
-    plt.savefig(plot_path)
+@app.route('/plot.png')
 
-    plot_url = url_for('static', filename='stock_plot.png')
+def plot():
 
+    symbol = request.args['symbol']
 
+    period_str = request.args['period']
+
+
+
+    try:
+
+        df_window, interval = get_stock_data(symbol, period_str)
+
+    except (ValueError, RuntimeError, requests.RequestException) as e:
+
+        return str(e), 400
+
+
+
+    if df_window.empty:
+
+        return "No data in the requested window.", 404
 
-    return render_template('index.html', 
 
-                           plot_url=plot_url, 
 
-                           data=df_window.to_html(index=False))
+    # Render in memory; the shared figure is reused across requests under a lock
+
+    buf = io.BytesIO()
+
+    with PLOT_LOCK:
+
+        _plot_close(PLOT_AX, df_window, symbol, interval)
+
+        PLOT_FIG.tight_layout()
+
+        PLOT_FIG.savefig(buf, format="png", dpi=90)
+
+    buf.seek(0)
+
+    return send_file(buf, mimetype="image/png")
 
 
 
@@ -270,7 +469,7 @@ def main_cli():
 
         df_window, interval = get_stock_data(symbol, period_str)
 
-    except (ValueError, RuntimeError) as e:
+    except (ValueError, RuntimeError, requests.RequestException) as e:
 
         print(f"Error: {e}", file=sys.stderr)
 
@@ -286,26 +485,19 @@ def main_cli():
 
 
 
-    print(df_window.to_string())
-
-
+    # Tab-separated output goes through the C CSV writer rather than to_string
 
-    # Generate plot
-
-    import matplotlib.pyplot as plt
+    df_window.to_csv(sys.stdout, index=False, sep="\t", float_format="%.4f")
 
-    plt.figure()
 
-    plt.plot(df_window["time"], df_window["close"])
 
-    plt.title(f"{symbol} close ({interval})")
+    # Generate plot
 
-    plt.xlabel("Time")
+    fig, ax = plt.subplots()
 
-    plt.ylabel("Close")
+    _plot_close(ax, df_window, symbol, interval)
 
-    plt.xticks(rotation=30, ha="right")
-    plt.tight_layout()
+    fig.tight_layout()
     plt.show()
 
 